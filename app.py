@@ -1,98 +1,378 @@
-try:
-    import google.generativeai as genai
-except ModuleNotFoundError:
-    genai = None
-
+import concurrent.futures
+import hashlib
+import logging
 import sqlite3
 import os
+import pathlib
+import random
+import threading
+import time
 import streamlit as st
 from dotenv import load_dotenv
 import re
-from support_agent import get_support_agent
 
 load_dotenv()  # Load all the env variables - updated with google api key
 
+# Unknown LOG_LEVEL values fall back to WARNING instead of failing at startup
+_log_level = getattr(logging, os.getenv("LOG_LEVEL", "WARNING").upper(), None)
+logging.basicConfig(level=_log_level if isinstance(
+    _log_level, int) else logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+# The Gemini SDK pulls in grpc/protobuf, so it is imported and configured on
+# first use rather than on every script rerun. `genai` becomes a module global
+# once loaded (None if the SDK is not installed).
+
+
+def _genai():
+    global genai
+    if "genai" not in globals():
+        try:
+            import google.generativeai as genai
+        except ModuleNotFoundError:
+            genai = None
+        else:
+            # Configure the API key
+            genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+    return genai
+
+
+def __getattr__(name):
+    if name == "genai":
+        return _genai()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Models are built once per (name, system instruction) instead of on every request.
+# Streamlit re-executes this script on every rerun, so process-wide objects are
+# held in st.cache_resource rather than plain module globals.
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _get_model(name, system_instruction=None):
+    return _genai().GenerativeModel(name, system_instruction=system_instruction)
+
+
+# Retry policy for rate-limited Gemini calls
+_MAX_ATTEMPTS = 8
+_MAX_BACKOFF = 60
+_RETRY_AFTER_RE = re.compile(
+    r"retry(?:[-_ ]after| in|_delay)\D{0,20}?(\d+(?:\.\d+)?)", re.IGNORECASE)
+
+
+class TokenBucket:
+    """Thread-safe token bucket used to keep Gemini calls under the RPM cap"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1, timeout=None):
+        """Take tokens, waiting up to timeout seconds; returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens +
+                                   (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+# At most this many Gemini requests in flight across all sessions
+_MAX_CONCURRENT_REQUESTS = 5
+_SLOT_TIMEOUT = 2
+
+
+@st.cache_resource
+def _rate_limiters():
+    # ~15 requests per minute, matching the Gemini free tier
+    return TokenBucket(rate=0.2, capacity=15), threading.BoundedSemaphore(_MAX_CONCURRENT_REQUESTS)
+
+
+_bucket, _SEM = _rate_limiters()
+
+
+class ServerBusyError(Exception):
+    """Raised when no Gemini request slot or rate-limit token frees up in time"""
+
+
+def _is_rate_limited(error):
+    error_message = str(error).lower()
+    return "429" in error_message or "quota" in error_message or "exceeded" in error_message
+
+
+# Gemini calls run on a worker pool so the script thread stays free for the UI
+_LLM_TIMEOUT = 60
+# Total time one call may spend waiting on the bucket and backing off, kept
+# under _LLM_TIMEOUT so a timed-out worker does not linger in the pool
+_RETRY_BUDGET = 40
+
+
+def _generate_with_retry(model, contents):
+    """Call generate_content, backing off with jitter on rate-limit errors only."""
+    deadline = time.monotonic() + _RETRY_BUDGET
+    for attempt in range(_MAX_ATTEMPTS):
+        remaining = max(0, deadline - time.monotonic())
+        if not _bucket.acquire(1, timeout=min(30, remaining)):
+            # Client-side throttle, not an API quota error
+            raise ServerBusyError(
+                "Too many Gemini requests queued, please retry shortly")
+        if not _SEM.acquire(timeout=_SLOT_TIMEOUT):
+            raise ServerBusyError("Server busy, please retry")
+        try:
+            return model.generate_content(contents)
+        except Exception as e:
+            delay = min(_MAX_BACKOFF, 2 ** attempt + random.random())
+            retry_after = _RETRY_AFTER_RE.search(str(e))
+            if retry_after:
+                delay = min(_MAX_BACKOFF, float(retry_after.group(1)))
+            if (not _is_rate_limited(e) or attempt == _MAX_ATTEMPTS - 1
+                    or time.monotonic() + delay > deadline):
+                raise
+        finally:
+            _SEM.release()
+        # Back off without holding a request slot
+        time.sleep(delay)
+
+
+# Workers also sleep through backoffs, so the pool is larger than the number of
+# in-flight requests. Submissions take a pool slot first and fail fast with
+# ServerBusyError instead of waiting unseen in the executor queue.
+_POOL_SIZE = 2 * _MAX_CONCURRENT_REQUESTS
+
+
+@st.cache_resource
+def _executor():
+    return (concurrent.futures.ThreadPoolExecutor(max_workers=_POOL_SIZE),
+            threading.BoundedSemaphore(_POOL_SIZE))
+
+
+_EXEC, _POOL_SLOTS = _executor()
+
+
+def _run_in_background(fn, *args):
+    if not _POOL_SLOTS.acquire(timeout=_SLOT_TIMEOUT):
+        raise ServerBusyError("Server busy, please retry")
+    try:
+        future = _EXEC.submit(fn, *args)
+    except BaseException:
+        _POOL_SLOTS.release()
+        raise
+    future.add_done_callback(lambda f: _POOL_SLOTS.release())
+    try:
+        return future.result(timeout=_LLM_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        raise Exception(
+            f"⚠️ Gemini did not respond within {_LLM_TIMEOUT} seconds. Please try again.")
+
+# Persistent cache of Gemini responses, shared across sessions and restarts.
+# Entries expire after the same TTL as the st.cache_data layer in front of it.
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "llm_cache.db")
+_LLM_CACHE_TTL = 3600
+
+
+def _llm_cache_key(*parts):
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+
+@st.cache_resource
+def _llm_cache_connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS llm_cache(hash TEXT PRIMARY KEY, response TEXT, ts INTEGER);
+        CREATE INDEX IF NOT EXISTS idx_llm_cache_ts ON llm_cache(ts);
+    """)
+    return conn, threading.Lock()
+
+
+def _llm_cache_get(key):
+    try:
+        conn, lock = _llm_cache_connect(LLM_CACHE_DB)
+        with lock:
+            row = conn.execute(
+                "SELECT response FROM llm_cache WHERE hash = ? AND ts > ?",
+                (key, int(time.time()) - _LLM_CACHE_TTL)).fetchone()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
 
-# Configure the API key
-if genai:
-    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
-# Initialize support agent for ticket routing
-support_agent = get_support_agent()
+def _llm_cache_put(key, response):
+    try:
+        conn, lock = _llm_cache_connect(LLM_CACHE_DB)
+        now = int(time.time())
+        with lock, conn:
+            # Drop expired rows so the cache file does not grow without bound
+            conn.execute("DELETE FROM llm_cache WHERE ts <= ?",
+                         (now - _LLM_CACHE_TTL,))
+            conn.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?)",
+                         (key, response, now))
+    except sqlite3.Error:
+        pass
+
+
+def _sql_response_key(question, prompt):
+    return _llm_cache_key(prompt[0], question.strip().lower())
 
 # Function to Load Gemini Model and provide sql query response
 
 
+@st.cache_data(ttl=_LLM_CACHE_TTL, show_spinner=False)
 def get_gemini_response(question, prompt):
-    if not genai:
+    if not _genai():
         raise Exception(
             "Gemini SDK not installed. Install google-generativeai to use this feature.")
 
+    # Only validated replies reach the persistent cache (see remember_sql_response)
+    cached = _llm_cache_get(_sql_response_key(question, prompt))
+    if cached is not None:
+        return cached
+
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content([prompt[0], question])
+        model = _get_model('gemini-pro', prompt[0])
+        response = _generate_with_retry(model, question)
         return response.text
+    except ServerBusyError:
+        raise
     except Exception as e:
         error_message = str(e)
-        if "429" in error_message or "quota" in error_message.lower() or "exceeded" in error_message.lower():
+        if _is_rate_limited(e):
             raise Exception(
                 "⚠️ API Quota Exceeded: You have reached the rate limit for the Gemini API. Please wait a few moments and try again, or check your API plan and billing details at https://ai.dev/usage")
         else:
             raise Exception(f"API Error: {error_message}")
 
 
+def remember_sql_response(question, prompt, response):
+    """Persist a Gemini SQL reply once its SQL has been extracted and validated"""
+    _llm_cache_put(_sql_response_key(question, prompt), response)
+
+
+def forget_sql_response(question, prompt):
+    """Drop an unusable reply from the in-process cache so a retry asks Gemini again"""
+    get_gemini_response.clear(question, prompt)
+
+
+# Only the first rows of large results are sent to Gemini for formatting
+_RESULT_PREVIEW_ROWS = 50
+
+
+def _preview_results(sql_results):
+    if isinstance(sql_results, list) and len(sql_results) > _RESULT_PREVIEW_ROWS:
+        preview = sql_results[:_RESULT_PREVIEW_ROWS]
+        return f"{len(sql_results)} rows total; showing first {len(preview)}\n{preview}"
+    return str(sql_results)
+
 # Function to format SQL results into human-readable text
 
 
+@st.cache_data(ttl=_LLM_CACHE_TTL, show_spinner=False)
 def format_results_to_text(question, sql_results):
-    if not genai:
+    if not _genai():
         return f"Auto answer fallback: {question} (no Gemini SDK available)"
 
+    results_text = _preview_results(sql_results)
+    cache_key = _llm_cache_key(question.strip().lower(), results_text)
+    cached = _llm_cache_get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        model = genai.GenerativeModel('gemini-2.5-pro')
         format_prompt = f"""
     The user asked: "{question}"
 
     The SQL query returned the following results:
-    {sql_results}
+    {results_text}
 
     Please provide a clear, human-readable answer based on these results.
     Format the answer in a conversational way without showing raw data tuples.
     """
-        response = model.generate_content(format_prompt)
+        response = _generate_with_retry(
+            _get_model('gemini-2.5-pro'), format_prompt)
+        _llm_cache_put(cache_key, response.text)
         return response.text
+    except ServerBusyError:
+        raise
     except Exception as e:
         error_message = str(e)
-        if "429" in error_message or "quota" in error_message.lower() or "exceeded" in error_message.lower():
+        if _is_rate_limited(e):
             raise Exception(
                 "⚠️ API Quota Exceeded: You have reached the rate limit for the Gemini API. Please wait a few moments and try again, or check your API plan and billing details at https://ai.dev/usage")
         else:
             raise Exception(f"API Error: {error_message}")
 
+# Shared read-only SQLite connection per database file, reused across reruns
+# and sessions. LLM-generated SQL can never write through it.
+
+
+@st.cache_resource
+def get_conn(db):
+    uri = pathlib.Path(db).resolve().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.execute("PRAGMA query_only=1")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-64000")
+    return conn
+
 # Function to retrieve data from the sql database
 
 
+def _db_mtime(db):
+    # Committed WAL-mode writes land in the -wal file before a checkpoint
+    wal = db + "-wal"
+    mtime = os.path.getmtime(db)
+    return max(mtime, os.path.getmtime(wal)) if os.path.exists(wal) else mtime
+
+
+# Whitespace runs outside quoted literals/identifiers, for the result cache key
+_SQL_WS_RE = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|\s+""")
+
+
+def _normalize_sql(sql):
+    return _SQL_WS_RE.sub(lambda m: m.group(1) or " ", sql.strip())
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _cached_read(sql_norm, params, db_mtime, db, _sql):
+    # sql_norm is only the cache key; the caller's SQL is what gets executed
+    return get_conn(db).execute(_sql, params or ()).fetchall()
+
+
 def read_sql_query(sql, db, params=None):
-    conn = sqlite3.connect(db)
-    cursor = conn.cursor()
-    if params:
-        cursor.execute(sql, params)
-    else:
-        cursor.execute(sql)
-    rows = cursor.fetchall()
-    conn.commit()
-    conn.close()
-    return rows
+    return _cached_read(_normalize_sql(sql), params, _db_mtime(db), db, sql)
 
 
 def introspect_schema(db, table='fintech'):
-    conn = sqlite3.connect(db)
-    cursor = conn.cursor()
-    cursor.execute(f"PRAGMA table_info({table})")
-    rows = cursor.fetchall()
-    conn.close()
+    rows = get_conn(db).execute(f"PRAGMA table_info({table})").fetchall()
     return [row[1] for row in rows]
 
+@st.cache_data(ttl=10, show_spinner=False)
+def support_ticket_stats(db='support_tickets.db'):
+    """Return (open, total, distinct categories) for the support statistics panel"""
+    open_tickets, total_tickets, categories_count = get_conn(db).execute(
+        "SELECT SUM(status = 'open'), COUNT(*), COUNT(DISTINCT category) FROM support_tickets").fetchone()
+    return open_tickets or 0, total_tickets, categories_count
+
+# Generated SQL between triple backticks, without the optional `sql` language tag
+_SQL_RE = re.compile(r'```(?:sql\b)?\s*(.*?)```', re.DOTALL | re.IGNORECASE)
+
+
+def extract_sql(response):
+    sql_match = _SQL_RE.search(response)
+    return sql_match.group(1).strip() if sql_match else None
+
 # SQL injection defense:
 # whitelist table/column names
 # regex check for ; DROP|UPDATE|DELETE|ALTER etc
@@ -105,6 +385,10 @@ def enforce_safe_query(sql_query, allowed_tables, allowed_columns, row_limit=100
     if not lowered.startswith("select"):
         raise Exception("Only SELECT queries are allowed in this interface.")
 
+    if not sqlite3.complete_statement(normalized + ";"):
+        raise Exception(
+            "Unsafe SQL: statement is incomplete (unterminated string or comment).")
+
     if ";" in normalized and not normalized.rstrip().endswith(";"):
         raise Exception("Unsafe SQL: semicolons are not permitted in queries.")
 
@@ -137,22 +421,18 @@ def enforce_safe_query(sql_query, allowed_tables, allowed_columns, row_limit=100
     return normalized
 
 
+# The system prompt lives in prompts/fintech.txt and is read once per process
+PROMPT_PATH = pathlib.Path(__file__).parent / "prompts" / "fintech.txt"
+
+
+@st.cache_data(show_spinner=False)
+def load_prompt_template(path=PROMPT_PATH):
+    return pathlib.Path(path).read_text(encoding="utf-8")
+
+
 def build_prompt(schema_columns, table='fintech'):
     columns_info = "\n".join([f"    - {c}" for c in schema_columns])
-    return [f"""
-    You are an expert financial data analyst. You have access to a SQL database named 'fintech.db' which contains a table called '{table}' with the following columns:\n{columns_info}
-    Use your SQL skills to analyze the data and provide insights based on user queries.
-    The SQL Command should be a SELECT query and should use this exact table and columns.\n
-    Carefully generate the SQL statement only; do not include data values in natural language text.
-    Wrap generated SQL in triple backticks (```), optionally with language tag `sql`.
-
-    Example Queries:\n
-    1. \"What is the total amount of completed transactions?\"\n    SQL:\n        \"SELECT SUM(amount) FROM fintech WHERE status = 'Completed' LIMIT 1000;\"\n
-    2. \"How many transactions are pending?\"\n    SQL:\n        \"SELECT COUNT(*) FROM fintech WHERE status = 'Pending' LIMIT 1000;\"\n
-    3. \"List all failed transactions.\"\n    SQL:\n        \"SELECT * FROM fintech WHERE status = 'Failed' LIMIT 1000;\"\n
-    Enforce safe SQL generation and do not include dangerous operations (DROP/DELETE/UPDATE/ALTER/INSERT).\n
-"""
-            ]
+    return [load_prompt_template().format(table=table, columns_info=columns_info)]
 
 # Streamlit App
 
@@ -174,23 +454,31 @@ with tab1:
     if submit:
         if not question:
             st.error("Please enter a question before submitting")
+        elif st.session_state.get("last_q") == (question, query_params):
+            # Same question as the previous run: reuse the answer, skip Gemini and SQLite
+            st.subheader("Answer:")
+            st.write(st.session_state["last_ans"])
+
+            st.subheader("Executed SQL")
+            st.code(st.session_state["last_sql"], language='sql')
         else:
             try:
                 schema_columns = introspect_schema('fintech.db')
                 prompt = build_prompt(schema_columns)
-                response = get_gemini_response(question, prompt)
-                print("Gemini Pro Response:", response)
-
-                # Extract SQL query from the response (between triple backticks)
-                sql_match = re.search(r'```(.*?)```', response, re.DOTALL)
-                if sql_match:
-                    sql_query = sql_match.group(1).strip()
-                    # Remove 'sql' language identifier if present
-                    sql_query = re.sub(
-                        r'^sql\n', '', sql_query, flags=re.IGNORECASE)
-
-                    safe_sql = enforce_safe_query(sql_query, {"fintech"}, [
-                                                  c.lower() for c in schema_columns])
+                with st.spinner("🤖 Generating SQL with Gemini..."):
+                    response = _run_in_background(
+                        get_gemini_response, question, prompt)
+                logger.debug("Gemini Pro Response: %s", response)
+
+                sql_query = extract_sql(response)
+                if sql_query:
+                    try:
+                        safe_sql = enforce_safe_query(sql_query, {"fintech"}, [
+                                                      c.lower() for c in schema_columns])
+                    except Exception:
+                        forget_sql_response(question, prompt)
+                        raise
+                    remember_sql_response(question, prompt, response)
                     params = [p.strip()
                               for p in query_params.split(",") if p.strip()]
                     query_params_tuple = tuple(params) if params else None
@@ -199,20 +487,29 @@ with tab1:
                         safe_sql, 'fintech.db', params=query_params_tuple)
 
                     # Format the results into human-readable text
-                    formatted_answer = format_results_to_text(question, data)
+                    with st.spinner("✍️ Summarizing the results..."):
+                        formatted_answer = _run_in_background(
+                            format_results_to_text, question, data)
                     st.subheader("Answer:")
                     st.write(formatted_answer)
 
                     st.subheader("Executed SQL")
                     st.code(safe_sql, language='sql')
 
+                    st.session_state["last_q"] = (question, query_params)
+                    st.session_state["last_ans"] = formatted_answer
+                    st.session_state["last_sql"] = safe_sql
+
                 else:
+                    forget_sql_response(question, prompt)
                     st.warning(
                         "Could not extract SQL query from the response. Generating fallback answer.")
-                    fallback_text = format_results_to_text(
-                        question, "No SQL results available due to missing SQL extraction.")
+                    fallback_text = _run_in_background(
+                        format_results_to_text, question, "No SQL results available due to missing SQL extraction.")
                     st.subheader("Fallback Answer")
                     st.write(fallback_text)
+            except ServerBusyError as e:
+                st.warning(str(e))
             except Exception as e:
                 st.error(str(e))
 
@@ -241,8 +538,13 @@ with tab2:
         else:
             with st.spinner("🤖 Analyzing your query with AI..."):
                 try:
+                    # Initialize support agent for ticket routing on first use
+                    if st.session_state.setdefault("support_agent", None) is None:
+                        from support_agent import get_support_agent
+                        st.session_state["support_agent"] = get_support_agent()
+
                     # Process query through support agent
-                    result = support_agent.process_query(
+                    result = st.session_state["support_agent"].process_query(
                         support_query, customer_email)
 
                     # Display results
@@ -284,20 +586,7 @@ with tab2:
     st.divider()
     st.subheader("📈 Support Statistics")
     try:
-        conn = sqlite3.connect('support_tickets.db')
-        cursor = conn.cursor()
-
-        cursor.execute(
-            "SELECT COUNT(*) FROM support_tickets WHERE status = 'open'")
-        open_tickets = cursor.fetchone()[0]
-
-        cursor.execute("SELECT COUNT(*) FROM support_tickets")
-        total_tickets = cursor.fetchone()[0]
-
-        cursor.execute("SELECT COUNT(DISTINCT category) FROM support_tickets")
-        categories_count = cursor.fetchone()[0]
-
-        conn.close()
+        open_tickets, total_tickets, categories_count = support_ticket_stats()
 
         col1, col2, col3 = st.columns(3)
         with col1:
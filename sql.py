@@ -1,32 +1,29 @@
 import sqlite3
 
+## Seed records for the fintech table
+SEED_ROWS = [
+    (1, 1001, 250.75, 'Completed', '2024-06-01', 'Payment received'),
+    (2, 1002, 125.00, 'Pending', '2024-06-02', 'Invoice sent'),
+    (3, 1003, 300.50, 'Failed', '2024-06-03', 'Payment failed'),
+]
+
 ## Connect to sqlite database
 connection = sqlite3.connect('fintech.db')
 
-##  Create a cursor object to insert record, create table, retrieve record
-cursor = connection.cursor()
-
-## Create a table
-table_info = """
+## Configure the journal and create the table in one script
+connection.executescript("""
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
 CREATE TABLE IF NOT EXISTS fintech(id INT PRIMARY KEY, transaction_id INT, amount FLOAT, status VARCHAR(25), date TEXT, description TEXT);
+""")
 
-"""
-
-cursor.execute(table_info)
-
-
-## Insert record into the table
-cursor.execute("INSERT INTO fintech VALUES (1, 1001, 250.75, 'Completed', '2024-06-01', 'Payment received')")
-cursor.execute("INSERT INTO fintech VALUES (2, 1002, 125.00, 'Pending', '2024-06-02', 'Invoice sent')")
-cursor.execute("INSERT INTO fintech VALUES (3, 1003, 300.50, 'Failed', '2024-06-03', 'Payment failed')")
-
+## Insert records in a single transaction; re-running the script skips existing ids
+with connection:
+    connection.executemany(
+        "INSERT OR IGNORE INTO fintech VALUES (?, ?, ?, ?, ?, ?)", SEED_ROWS)
 
-## Display all records from the table
-print("Inserted records:")
-data = cursor.execute("SELECT * FROM fintech")
-for row in data:
-    print(row)
+## Report how many records the table holds
+print(connection.execute("SELECT COUNT(*) FROM fintech").fetchone()[0], "rows")
 
 ## Close the connection
-connection.commit()
-connection.close()
\ No newline at end of file
+connection.close()
@@ -1,26 +1,51 @@
 """
 Agentic AI Support Router - Redirects queries to customer support via email
-Uses LLM, RAG, and Vector DB for intelligent query classification and routing
+Uses LLM, RAG, and vector similarity for intelligent query classification and routing
 """
 
 import google.generativeai as genai
+import functools
 import sqlite3
 import os
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from datetime import datetime
+import secrets
+import threading
+import time
+from email.message import EmailMessage
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-import json
-from typing import Dict, List, Tuple
-import chromadb
-from chromadb.config import Settings
+import re
+import orjson
+from typing import Dict, List, Optional, Tuple
+import numpy as np
 
 load_dotenv()
 
 # Configure Gemini API
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
+# JSON object in the analysis response, with or without a ```json fence
+_JSON_RE = re.compile(r'```(?:json)?\s*(\{.*?\})\s*```|(\{.*\})', re.DOTALL)
+
+# Embedding model for the vector classifier
+EMBEDDING_MODEL = "models/text-embedding-004"
+
+# Vector similarity bands on text-embedding-004 cosine scores: confident matches
+# route without calling Gemini, weak matches are handled as general queries, and
+# Gemini decides the band in between. These are conservative starting points
+# rather than measured values; override them from the environment once they
+# have been calibrated against real queries.
+VECTOR_ROUTE_THRESHOLD = float(os.getenv("VECTOR_ROUTE_THRESHOLD", "0.80"))
+VECTOR_GENERAL_THRESHOLD = float(os.getenv("VECTOR_GENERAL_THRESHOLD", "0.35"))
+# Vector-only routing cut-off, used when the Gemini analysis fails
+VECTOR_BACKUP_THRESHOLD = float(os.getenv("VECTOR_BACKUP_THRESHOLD", "0.60"))
+# Gemini confidence needed to route a support category
+SUPPORT_CONFIDENCE_THRESHOLD = 0.5
+
+# Per-instance memo sizes, and how long a Gemini verdict is reused
+_CACHE_SIZE = 2048
+ANALYSIS_CACHE_TTL = 3600
+
 # Support categories for classification
 SUPPORT_CATEGORIES = {
     "bank_account": [
@@ -60,134 +85,222 @@ SUPPORT_CATEGORIES = {
     ]
 }
 
+# Ticket priority per category; anything not listed is medium
+_PRIORITY_MAP = {"kyc": "high", "bank_account": "high"}
+
+# Lowercased keyword -> category, for exact keyword hits that need no embedding
+_KW_INDEX: Dict[str, str] = {
+    keyword.lower(): category
+    for category, keywords in SUPPORT_CATEGORIES.items()
+    for keyword in keywords
+}
+# Longest keywords first so the most specific phrase wins
+_KW_RE = re.compile(r"\b(?:" + "|".join(
+    re.escape(keyword) for keyword in sorted(_KW_INDEX, key=len, reverse=True)) + r")\b")
+
+# Email bodies, filled from the ticket dict with str.format_map
+_SUPPORT_BODY_TMPL = """
+New Support Ticket Created
+
+Ticket Number: {ticket_number}
+Category: {category}
+Priority: {priority}
+Created: {created_at}
+
+Customer Email: {user_email}
+
+Customer Query:
+{user_query}
+
+---
+Please log in to the dashboard to review and respond to this ticket.
+"""
+
+_CUSTOMER_BODY_TMPL = """
+Dear Customer,
+
+Thank you for contacting us. Your support ticket has been created and assigned to our team.
+
+Ticket Number: {ticket_number}
+Category: {category}
+Status: Open
+
+Your query has been marked as {priority} priority and will be addressed shortly.
+Our support team will reach out to you within 24 hours.
+
+Best regards,
+FinTech Support Team
+"""
+
 
 class SupportTicketDatabase:
     """Manages support tickets in SQLite database"""
 
     def __init__(self, db_path='support_tickets.db'):
         self.db_path = db_path
+        # One connection for the lifetime of the database object; writes are
+        # serialized by the lock since it is shared across Streamlit threads
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-64000;
+        """)
+        self._lock = threading.Lock()
         self.init_database()
 
     def init_database(self):
         """Initialize support tickets table"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS support_tickets (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ticket_number TEXT UNIQUE,
-                user_email TEXT NOT NULL,
-                user_query TEXT NOT NULL,
-                category TEXT NOT NULL,
-                priority TEXT DEFAULT 'medium',
-                status TEXT DEFAULT 'open',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                assigned_to TEXT,
-                resolution_notes TEXT,
-                email_sent BOOLEAN DEFAULT 0,
-                email_sent_at TIMESTAMP
-            )
-        """)
-
-        conn.commit()
-        conn.close()
-
-    def create_ticket(self, user_email: str, user_query: str, category: str, priority: str = "medium") -> str:
-        """Create a new support ticket"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        ticket_number = f"TKT-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-
-        cursor.execute("""
-            INSERT INTO support_tickets (ticket_number, user_email, user_query, category, priority)
-            VALUES (?, ?, ?, ?, ?)
-        """, (ticket_number, user_email, user_query, category, priority))
-
-        conn.commit()
-        conn.close()
-
-        return ticket_number
+        with self._lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS support_tickets (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ticket_number TEXT UNIQUE,
+                    user_email TEXT NOT NULL,
+                    user_query TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    priority TEXT DEFAULT 'medium',
+                    status TEXT DEFAULT 'open',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    assigned_to TEXT,
+                    resolution_notes TEXT,
+                    email_sent BOOLEAN DEFAULT 0,
+                    email_sent_at TIMESTAMP
+                )
+            """)
+
+            # Indexes for the support statistics panel and dashboard filters.
+            # ticket_number is already indexed through its UNIQUE constraint, and
+            # (status, category) supersedes the older status-only index.
+            self.conn.execute("DROP INDEX IF EXISTS idx_tickets_status")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tickets_status_cat ON support_tickets(status, category)")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tickets_category ON support_tickets(category)")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tickets_email ON support_tickets(user_email)")
+
+            # Gather planner statistics once so the indexes get picked up
+            if self.conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None:
+                self.conn.execute("ANALYZE")
+            # The agent lives for the whole process and is rarely closed, so
+            # refresh stale statistics on every start as well as on close()
+            self.conn.execute("PRAGMA optimize")
+
+    def create_ticket(self, user_email: str, user_query: str, category: str, priority: str = "medium") -> Dict:
+        """Create a new support ticket and return its details"""
+        # Millisecond timestamp plus a random suffix: unique even for same-second bursts
+        ticket_number = f"TKT-{int(time.time() * 1000)}-{secrets.token_hex(3)}"
+
+        with self._lock, self.conn:
+            row = self.conn.execute("""
+                INSERT INTO support_tickets (ticket_number, user_email, user_query, category, priority)
+                VALUES (?, ?, ?, ?, ?)
+                RETURNING ticket_number, user_email, user_query, category, priority, created_at
+            """, (ticket_number, user_email, user_query, category, priority)).fetchone()
+
+        return dict(row)
 
     def update_ticket_status(self, ticket_number: str, status: str):
         """Update ticket status"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            UPDATE support_tickets 
-            SET status = ?, updated_at = CURRENT_TIMESTAMP 
-            WHERE ticket_number = ?
-        """, (status, ticket_number))
-
-        conn.commit()
-        conn.close()
+        with self._lock, self.conn:
+            self.conn.execute("""
+                UPDATE support_tickets
+                SET status = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE ticket_number = ?
+            """, (status, ticket_number))
 
     def mark_email_sent(self, ticket_number: str):
         """Mark ticket as having email sent"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            UPDATE support_tickets 
-            SET email_sent = 1, email_sent_at = CURRENT_TIMESTAMP
-            WHERE ticket_number = ?
-        """, (ticket_number,))
+        with self._lock, self.conn:
+            self.conn.execute("""
+                UPDATE support_tickets
+                SET email_sent = 1, email_sent_at = CURRENT_TIMESTAMP
+                WHERE ticket_number = ?
+            """, (ticket_number,))
 
-        conn.commit()
-        conn.close()
+    def close(self):
+        """Refresh planner statistics if needed and close the connection"""
+        with self._lock:
+            self.conn.execute("PRAGMA optimize")
+            self.conn.close()
 
 
 class VectorRAGClassifier:
-    """Vector-based query classifier using ChromaDB for RAG"""
+    """Vector-based query classifier using an in-memory cosine index for RAG"""
 
     def __init__(self):
-        # Initialize ChromaDB with persistent storage
-        chroma_path = "./support_vectors"
-        os.makedirs(chroma_path, exist_ok=True)
-
-        settings = Settings(
-            chroma_db_impl="duckdb+parquet",
-            persist_directory=chroma_path,
-            anonymized_telemetry=False,
-        )
-
-        self.client = chromadb.Client(settings)
-        self.collection = self.client.get_or_create_collection(
-            name="support_queries",
-            metadata={"hnsw:space": "cosine"}
-        )
-
+        # Memoized per instance so the cache dies with the classifier
+        self._classify_cached = functools.lru_cache(
+            maxsize=_CACHE_SIZE)(self._classify)
         self.init_vectors()
 
+    def _embed(self, texts: List[str], task_type: str) -> np.ndarray:
+        """Embed texts with Gemini and L2-normalize each row"""
+        result = genai.embed_content(
+            model=EMBEDDING_MODEL, content=texts, task_type=task_type)
+        vectors = np.asarray(result["embedding"], dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
     def init_vectors(self):
         """Initialize vectors with support categories and examples"""
-        if self.collection.count() == 0:
-            for category, keywords in SUPPORT_CATEGORIES.items():
-                for idx, keyword in enumerate(keywords):
-                    self.collection.add(
-                        ids=[f"{category}_{idx}"],
-                        metadatas=[{"category": category}],
-                        documents=[keyword]
-                    )
-
-    def classify_query(self, query: str, top_k: int = 1) -> Tuple[str, float]:
-        """Classify query to determine support category"""
-        results = self.collection.query(
-            query_texts=[query],
-            n_results=top_k
-        )
-
-        if results['metadatas'] and len(results['metadatas']) > 0:
-            category = results['metadatas'][0][0]['category']
-            distance = results['distances'][0][0]
-            # Convert distance to similarity score (0-1)
-            similarity = max(0, 1 - distance)
-            return category, similarity
-
-        return "general", 0.0
+        categories, documents = [], []
+        for category, keywords in SUPPORT_CATEGORIES.items():
+            for keyword in keywords:
+                categories.append(category)
+                documents.append(keyword)
+
+        # One batched embedding call; rows of kw_mat_i8 line up with kw_cats.
+        # Rows are stored as symmetric per-row int8 with their scales kept for dequantizing
+        try:
+            vectors = self._embed(documents, "retrieval_document")
+        except Exception as e:
+            # Leave the index empty; it is rebuilt on the next classification
+            print(f"Error building vector index: {str(e)}")
+            self.kw_mat_i8 = np.empty((0, 0), dtype=np.int8)
+            self.kw_scale = np.empty(0, dtype=np.float32)
+            self.kw_cats = np.array([])
+            return
+        self.kw_mat_i8, self.kw_scale = self._quantize(vectors)
+        self.kw_cats = np.array(categories)
+
+    @staticmethod
+    def _quantize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Scale each row so its largest component maps to +/-127 and cast to int8"""
+        scale = 127 / np.max(np.abs(vectors), axis=1)
+        return np.rint(vectors * scale[:, None]).astype(np.int8), scale.astype(np.float32)
+
+    def classify_query(self, query: str) -> Optional[Tuple[str, float]]:
+        """Classify query to determine support category; None if embeddings are unavailable"""
+        try:
+            return self._classify_cached(query.strip().lower())
+        except Exception as e:
+            print(f"Error in vector classification: {str(e)}")
+            return None
+
+    def _classify(self, query: str) -> Tuple[str, float]:
+        """Vector lookup for a normalized query; embedding failures raise and are not cached"""
+        keyword_match = _KW_RE.search(query)
+        if keyword_match:
+            return _KW_INDEX[keyword_match.group(0)], 1.0
+
+        if len(self.kw_cats) == 0:
+            self.init_vectors()
+            if len(self.kw_cats) == 0:
+                raise RuntimeError("Vector index is not available")
+
+        # Cosine similarity against every keyword in one int8 matrix-vector
+        # product, accumulated in int32 and rescaled back to float
+        query_i8, query_scale = self._quantize(
+            self._embed([query], "retrieval_query"))
+        dots = self.kw_mat_i8.astype(np.int32) @ query_i8[0].astype(np.int32)
+        sims = dots / (self.kw_scale * query_scale[0])
+        best = int(np.argmax(sims))
+        return str(self.kw_cats[best]), max(0.0, float(sims[best]))
 
 
 class SupportEmailNotifier:
@@ -199,6 +312,49 @@ class SupportEmailNotifier:
         self.sender_email = os.getenv("SUPPORT_EMAIL")
         self.sender_password = os.getenv("SUPPORT_EMAIL_PASSWORD")
         self.support_team_email = os.getenv("SUPPORT_TEAM_EMAIL")
+        # Logged-in SMTP session shared by all sends; the lock keeps one
+        # message on the wire at a time
+        self._smtp = None
+        self._smtp_lock = threading.Lock()
+
+    def _get_smtp(self) -> smtplib.SMTP:
+        """Return the open SMTP session, reconnecting if it has gone stale"""
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+        server = smtplib.SMTP(self.smtp_server, self.smtp_port)
+        server.starttls()
+        server.login(self.sender_email, self.sender_password)
+        self._smtp = server
+        return server
+
+    def _send(self, msg):
+        """Send a message over the shared session; drop the session on failure"""
+        with self._smtp_lock:
+            try:
+                self._get_smtp().send_message(msg)
+            except Exception:
+                self._smtp = None
+                raise
+
+    def close(self):
+        """Close the shared SMTP session"""
+        with self._smtp_lock:
+            if self._smtp is not None:
+                try:
+                    self._smtp.quit()
+                except (smtplib.SMTPException, OSError):
+                    pass
+                self._smtp = None
+
+    def send_both(self, ticket: Dict) -> Tuple[bool, bool]:
+        """Send the team notification and customer confirmation over one session"""
+        return self.send_ticket_notification(ticket), self.send_customer_confirmation(ticket)
 
     def send_ticket_notification(self, ticket: Dict) -> bool:
         """Send email notification to support team about new ticket"""
@@ -208,35 +364,14 @@ class SupportEmailNotifier:
                     "⚠️ Email credentials not configured. Ticket created but email not sent.")
                 return False
 
-            msg = MIMEMultipart()
+            msg = EmailMessage()
             msg['From'] = self.sender_email
             msg['To'] = self.support_team_email
             msg['Subject'] = f"New Support Ticket: {ticket['ticket_number']} - {ticket['category'].upper()}"
 
-            body = f"""
-New Support Ticket Created
-
-Ticket Number: {ticket['ticket_number']}
-Category: {ticket['category']}
-Priority: {ticket['priority']}
-Created: {ticket['created_at']}
+            msg.set_content(_SUPPORT_BODY_TMPL.format_map(ticket))
 
-Customer Email: {ticket['user_email']}
-
-Customer Query:
-{ticket['user_query']}
-
----
-Please log in to the dashboard to review and respond to this ticket.
-            """
-
-            msg.attach(MIMEText(body, 'plain'))
-
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()
-            server.login(self.sender_email, self.sender_password)
-            server.send_message(msg)
-            server.quit()
+            self._send(msg)
 
             print(
                 f"✅ Email notification sent for ticket {ticket['ticket_number']}")
@@ -252,34 +387,14 @@ Please log in to the dashboard to review and respond to this ticket.
             if not self.sender_email:
                 return False
 
-            msg = MIMEMultipart()
+            msg = EmailMessage()
             msg['From'] = self.sender_email
             msg['To'] = ticket['user_email']
             msg['Subject'] = f"Support Ticket Created: {ticket['ticket_number']}"
 
-            body = f"""
-Dear Customer,
-
-Thank you for contacting us. Your support ticket has been created and assigned to our team.
+            msg.set_content(_CUSTOMER_BODY_TMPL.format_map(ticket))
 
-Ticket Number: {ticket['ticket_number']}
-Category: {ticket['category']}
-Status: Open
-
-Your query has been marked as {ticket['priority']} priority and will be addressed shortly.
-Our support team will reach out to you within 24 hours.
-
-Best regards,
-FinTech Support Team
-            """
-
-            msg.attach(MIMEText(body, 'plain'))
-
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()
-            server.login(self.sender_email, self.sender_password)
-            server.send_message(msg)
-            server.quit()
+            self._send(msg)
 
             return True
 
@@ -295,14 +410,44 @@ class SupportAgent:
         self.classifier = VectorRAGClassifier()
         self.db = SupportTicketDatabase()
         self.emailer = SupportEmailNotifier()
+        # Emails are sent off the request path so routing returns after the DB insert
+        self._email_pool = ThreadPoolExecutor(max_workers=2)
         self.support_categories_set = set(SUPPORT_CATEGORIES.keys())
+        self.gemini = genai.GenerativeModel('gemini-pro')
+        # Normalized query -> (expiry, verdict); oldest entries are evicted first
+        self._analysis_cache: Dict[str, Tuple[float, Tuple[str, float]]] = {}
+        self._analysis_lock = threading.Lock()
 
     def analyze_query(self, user_query: str) -> Tuple[str, float]:
         """Analyze user query to determine if it needs support routing"""
-        try:
-            model = genai.GenerativeModel('gemini-pro')
+        return self._gemini_verdict(user_query) or ("general", 0.0)
+
+    def _gemini_verdict(self, user_query: str) -> Optional[Tuple[str, float]]:
+        """Memoized Gemini (category, confidence), or None if the analysis failed"""
+        query = user_query.strip().lower()
+        with self._analysis_lock:
+            cached = self._analysis_cache.get(query)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
 
-            analysis_prompt = f"""
+        try:
+            # The normalized text is only the memo key; Gemini sees the query as written
+            verdict = self._analyze(user_query)
+        except Exception as e:
+            print(f"Error in query analysis: {str(e)}")
+            return None
+
+        with self._analysis_lock:
+            self._analysis_cache.pop(query, None)
+            if len(self._analysis_cache) >= _CACHE_SIZE:
+                del self._analysis_cache[next(iter(self._analysis_cache))]
+            self._analysis_cache[query] = (
+                time.monotonic() + ANALYSIS_CACHE_TTL, verdict)
+        return verdict
+
+    def _analyze(self, user_query: str) -> Tuple[str, float]:
+        """Gemini analysis of the customer's query; failures raise and are not cached"""
+        analysis_prompt = f"""
 Analyze this customer query and determine if it requires support team assistance.
 
 Categories that ALWAYS need support routing:
@@ -320,37 +465,37 @@ Respond ONLY with a JSON object:
     "confidence": 0.0-1.0,
     "reason": "brief explanation"
 }}
-            """
-
-            response = model.generate_content(analysis_prompt)
+        """
 
-            # Parse JSON response
-            response_text = response.text.strip()
-            # Remove markdown code blocks if present
-            if response_text.startswith("```"):
-                response_text = response_text.split("```")[1]
-                if response_text.startswith("json"):
-                    response_text = response_text[4:]
+        response = self.gemini.generate_content(analysis_prompt)
 
-            result = json.loads(response_text)
-            return result.get("category", "general"), result.get("confidence", 0.0)
+        # Parse JSON response, skipping any markdown code fence
+        json_match = _JSON_RE.search(response.text)
+        if not json_match:
+            raise ValueError("No JSON object in analysis response")
+        result = orjson.loads(json_match.group(1) or json_match.group(2))
+        return result.get("category", "general"), result.get("confidence", 0.0)
 
+    def _send_and_mark(self, ticket: Dict):
+        """Send both ticket emails and record that they went out"""
+        try:
+            self.emailer.send_both(ticket)
+            self.db.mark_email_sent(ticket["ticket_number"])
         except Exception as e:
-            print(f"Error in query analysis: {str(e)}")
-            return "general", 0.0
+            print(
+                f"❌ Error dispatching emails for ticket {ticket['ticket_number']}: {str(e)}")
 
-    def should_route_to_support(self, user_query: str, category: str, confidence: float) -> bool:
+    def should_route_to_support(self, user_query: str, category: str, confidence: float,
+                                vector_result: Optional[Tuple[str, float]] = None) -> bool:
         """Determine if query should be routed to support"""
-        support_threshold = 0.5
-
         # Always route if category is one of the predefined categories
-        if category in self.support_categories_set and confidence > support_threshold:
+        if category in self.support_categories_set and confidence > SUPPORT_CONFIDENCE_THRESHOLD:
             return True
 
         # Use vector classifier as backup
-        vec_category, vec_confidence = self.classifier.classify_query(
-            user_query)
-        return vec_category in self.support_categories_set and vec_confidence > 0.3
+        vec_category, vec_confidence = vector_result or self.classifier.classify_query(
+            user_query) or ("general", 0.0)
+        return vec_category in self.support_categories_set and vec_confidence > VECTOR_BACKUP_THRESHOLD
 
     def process_query(self, user_query: str, user_email: str = "customer@example.com") -> Dict:
         """
@@ -373,55 +518,52 @@ Respond ONLY with a JSON object:
             "message": ""
         }
 
-        # Analyze the query
-        category, confidence = self.analyze_query(user_query)
+        # Classify with the vector index first. Gemini decides the ambiguous band,
+        # and every query while embeddings are unavailable; the vector result is
+        # only a fallback when the Gemini analysis fails
+        vector_result = self.classifier.classify_query(user_query)
+        vec_category, vec_confidence = vector_result or ("general", 0.0)
+        if vector_result is not None and vec_confidence >= VECTOR_ROUTE_THRESHOLD \
+                and vec_category in self.support_categories_set:
+            category, confidence, route = vec_category, vec_confidence, True
+        elif vector_result is not None and vec_confidence <= VECTOR_GENERAL_THRESHOLD:
+            category, confidence, route = "general", vec_confidence, False
+        else:
+            verdict = self._gemini_verdict(user_query)
+            if verdict is not None:
+                category, confidence = verdict
+                route = category in self.support_categories_set and \
+                    confidence > SUPPORT_CONFIDENCE_THRESHOLD
+            elif vector_result is not None and self.should_route_to_support(
+                    user_query, "general", 0.0, vector_result):
+                category, confidence, route = vec_category, vec_confidence, True
+            else:
+                category, confidence, route = "general", 0.0, False
         result["category"] = category
         result["confidence"] = confidence
 
         # Determine if routing is needed
-        if self.should_route_to_support(user_query, category, confidence):
+        if route:
             result["routed_to_support"] = True
 
             # Determine priority based on category
-            priority = "high" if category in [
-                "kyc", "bank_account"] else "medium"
+            priority = _PRIORITY_MAP.get(category, "medium")
 
             # Create support ticket
-            ticket_number = self.db.create_ticket(
+            ticket_dict = self.db.create_ticket(
                 user_email=user_email,
                 user_query=user_query,
                 category=category,
                 priority=priority
             )
+            ticket_number = ticket_dict["ticket_number"]
 
             result["ticket_number"] = ticket_number
 
-            # Get ticket details for email
-            conn = sqlite3.connect(self.db.db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT * FROM support_tickets WHERE ticket_number = ?", (ticket_number,))
-            row = cursor.fetchone()
-            conn.close()
-
-            if row:
-                ticket_dict = {
-                    "ticket_number": row[1],
-                    "user_email": row[2],
-                    "user_query": row[3],
-                    "category": row[4],
-                    "priority": row[5],
-                    "created_at": row[7]
-                }
-
-                # Send email notifications
-                self.emailer.send_ticket_notification(ticket_dict)
-                self.emailer.send_customer_confirmation(ticket_dict)
-
-                # Mark email as sent
-                self.db.mark_email_sent(ticket_number)
-
-                result["message"] = f"✅ Your query has been escalated to our support team. Ticket #{ticket_number} created. You will receive updates at {user_email}"
+            # Send email notifications and mark them sent in the background
+            self._email_pool.submit(self._send_and_mark, ticket_dict)
+
+            result["message"] = f"✅ Your query has been escalated to our support team. Ticket #{ticket_number} created. You will receive updates at {user_email}"
 
         else:
             result["message"] = "Query handled by AI assistant. If you need further assistance, please contact our support team."
@@ -429,8 +571,16 @@ Respond ONLY with a JSON object:
         return result
 
 
+_support_agent: Optional[SupportAgent] = None
+_support_agent_lock = threading.Lock()
+
+
 def get_support_agent() -> SupportAgent:
-    """Get or create support agent instance"""
-    if not hasattr(get_support_agent, 'instance'):
-        get_support_agent.instance = SupportAgent()
-    return get_support_agent.instance
+    """Get or create the process-wide support agent instance"""
+    global _support_agent
+    if _support_agent is None:
+        with _support_agent_lock:
+            # Re-check under the lock so concurrent first callers build only one agent
+            if _support_agent is None:
+                _support_agent = SupportAgent()
+    return _support_agent
@@ -1,6 +1,7 @@
 import app
 import os
 import sqlite3
+import subprocess
 import sys
 import tempfile
 
@@ -68,3 +69,270 @@ def test_format_results_to_text_fallback_when_no_genai():
         assert 'Auto answer fallback' in result
     finally:
         app.genai = original_genai
+
+
+def test_llm_cache_roundtrip(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        monkeypatch.setattr(app, "LLM_CACHE_DB",
+                            os.path.join(tmpdir, "cache.db"))
+        key = app._llm_cache_key("prompt", "how much?")
+        assert app._llm_cache_get(key) is None
+
+        app._llm_cache_put(key, "```SELECT 1```")
+        assert app._llm_cache_get(key) == "```SELECT 1```"
+        assert app._llm_cache_connect(app.LLM_CACHE_DB) is app._llm_cache_connect(
+            app.LLM_CACHE_DB)
+
+
+def test_llm_cache_entries_expire(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        monkeypatch.setattr(app, "LLM_CACHE_DB",
+                            os.path.join(tmpdir, "cache.db"))
+        key = app._llm_cache_key("prompt", "how much?")
+        app._llm_cache_put(key, "stale")
+
+        now = app.time.time()
+        monkeypatch.setattr(app.time, "time",
+                            lambda: now + app._LLM_CACHE_TTL + 1)
+        assert app._llm_cache_get(key) is None
+
+
+def test_read_sql_query_connection_is_read_only():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "readonly.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE fintech (id INTEGER PRIMARY KEY)")
+        conn.commit()
+        conn.close()
+
+        with pytest.raises(sqlite3.OperationalError):
+            app.read_sql_query("INSERT INTO fintech (id) VALUES (1)", db_path)
+        assert app.read_sql_query("SELECT COUNT(*) FROM fintech", db_path) == [(0,)]
+
+
+class _FlakyModel:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def generate_content(self, contents):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def test_generate_with_retry_backs_off_on_rate_limit(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(app.time, "sleep", sleeps.append)
+    model = _FlakyModel([Exception("429 Resource exhausted. Please retry in 3s"),
+                         Exception("Quota exceeded")])
+
+    assert app._generate_with_retry(model, "q") == "ok"
+    assert model.calls == 3
+    assert sleeps[0] == 3.0
+    assert 2 <= sleeps[1] < 3
+
+
+def test_generate_with_retry_fails_fast_on_other_errors(monkeypatch):
+    monkeypatch.setattr(app.time, "sleep", lambda s: pytest.fail("slept"))
+    model = _FlakyModel([ValueError("invalid argument")])
+
+    with pytest.raises(ValueError):
+        app._generate_with_retry(model, "q")
+    assert model.calls == 1
+
+
+def test_token_bucket_times_out_when_empty():
+    bucket = app.TokenBucket(rate=0.01, capacity=2)
+    assert bucket.acquire(1, timeout=0)
+    assert bucket.acquire(1, timeout=0)
+    assert not bucket.acquire(1, timeout=0.01)
+
+
+def test_read_sql_query_cache_invalidates_on_write():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "cached.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE fintech (id INTEGER PRIMARY KEY)")
+        conn.commit()
+
+        sql = "SELECT COUNT(*)   FROM fintech"
+        assert app.read_sql_query(sql, db_path) == [(0,)]
+
+        conn.execute("INSERT INTO fintech (id) VALUES (1)")
+        conn.commit()
+        conn.close()
+        os.utime(db_path, (0, os.path.getmtime(db_path) + 1))
+        assert app.read_sql_query(sql, db_path) == [(1,)]
+
+
+def test_read_sql_query_keeps_whitespace_in_literals():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "literals.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute(
+            "CREATE TABLE fintech (id INTEGER PRIMARY KEY, description TEXT)")
+        conn.execute(
+            "INSERT INTO fintech (id, description) VALUES (1, 'Payment  received')")
+        conn.commit()
+        conn.close()
+
+        assert app.read_sql_query(
+            "SELECT id FROM fintech WHERE description = 'Payment  received'", db_path) == [(1,)]
+        assert app.read_sql_query(
+            "SELECT id\n  FROM fintech WHERE description = 'Payment received'", db_path) == []
+
+
+def test_extract_sql_strips_language_tag():
+    assert app.extract_sql(
+        "Here you go:\n```sql\nSELECT * FROM fintech\n```") == "SELECT * FROM fintech"
+    assert app.extract_sql("```SELECT id FROM fintech```") == "SELECT id FROM fintech"
+    assert app.extract_sql("no code block") is None
+
+
+def test_enforce_safe_query_rejects_incomplete_statement():
+    with pytest.raises(Exception, match="statement is incomplete"):
+        app.enforce_safe_query(
+            "SELECT id FROM fintech WHERE status = 'Completed", {"fintech"}, {"id", "status"})
+
+
+def test_preview_results_truncates_large_results():
+    rows = [(i,) for i in range(120)]
+    preview = app._preview_results(rows)
+    assert preview.startswith("120 rows total; showing first 50")
+    assert "(49,)" in preview and "(50,)" not in preview
+
+    assert app._preview_results([(42,)]) == "[(42,)]"
+
+
+def test_generate_with_retry_reports_busy_when_no_slot_free(monkeypatch):
+    monkeypatch.setattr(app, "_SEM", app.threading.BoundedSemaphore(1))
+    monkeypatch.setattr(app, "_SLOT_TIMEOUT", 0.01)
+    app._SEM.acquire()
+    with pytest.raises(app.ServerBusyError):
+        app._generate_with_retry(_FlakyModel([]), "q")
+
+
+def test_generate_with_retry_reports_busy_when_bucket_empty(monkeypatch):
+    bucket = app.TokenBucket(rate=0.01, capacity=1)
+    monkeypatch.setattr(bucket, "acquire", lambda tokens=1, timeout=None: False)
+    monkeypatch.setattr(app, "_bucket", bucket)
+    with pytest.raises(app.ServerBusyError, match="requests queued"):
+        app._generate_with_retry(_FlakyModel([]), "q")
+
+
+def test_support_ticket_stats_single_query():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "tickets.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute(
+            "CREATE TABLE support_tickets (id INTEGER PRIMARY KEY, status TEXT, category TEXT)")
+        conn.executemany("INSERT INTO support_tickets (status, category) VALUES (?, ?)", [
+                         ('open', 'kyc'), ('closed', 'kyc'), ('open', 'debit_card')])
+        conn.commit()
+        conn.close()
+
+        assert app.support_ticket_stats(db_path) == (2, 3, 2)
+
+
+def test_build_prompt_renders_template():
+    prompt = app.build_prompt(["id", "amount"])
+    assert len(prompt) == 1
+    assert "a table called 'fintech'" in prompt[0]
+    assert "    - id\n    - amount" in prompt[0]
+    assert "{" not in prompt[0]
+
+
+def test_run_in_background_times_out(monkeypatch):
+    monkeypatch.setattr(app, "_LLM_TIMEOUT", 0.01)
+    with pytest.raises(Exception, match="did not respond"):
+        app._run_in_background(app.time.sleep, 0.5)
+    assert app._run_in_background(sum, [1, 2]) == 3
+
+
+def test_generate_with_retry_stays_within_budget(monkeypatch):
+    clock = [0.0]
+    sleeps = []
+
+    def fake_sleep(seconds):
+        sleeps.append(seconds)
+        clock[0] += seconds
+
+    monkeypatch.setattr(app.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(app.time, "sleep", fake_sleep)
+    monkeypatch.setattr(app, "_bucket", app.TokenBucket(rate=1, capacity=10))
+    model = _FlakyModel([Exception("429 Please retry in 30s")] * 5)
+
+    with pytest.raises(Exception, match="429"):
+        app._generate_with_retry(model, "q")
+    assert model.calls == 2
+    assert sleeps == [30.0]
+    assert app._RETRY_BUDGET < app._LLM_TIMEOUT
+
+
+def test_run_in_background_reports_busy_when_pool_full(monkeypatch):
+    monkeypatch.setattr(app, "_POOL_SLOTS", app.threading.BoundedSemaphore(1))
+    monkeypatch.setattr(app, "_SLOT_TIMEOUT", 0.01)
+    app._POOL_SLOTS.acquire()
+    with pytest.raises(app.ServerBusyError):
+        app._run_in_background(sum, [1, 2])
+
+    app._POOL_SLOTS.release()
+    assert app._run_in_background(sum, [1, 2]) == 3
+    assert app._POOL_SIZE >= app._MAX_CONCURRENT_REQUESTS
+
+
+class _TextModel:
+    def __init__(self, text):
+        self.text = text
+        self.calls = 0
+
+    def generate_content(self, contents):
+        self.calls += 1
+        return type("Response", (), {"text": self.text})()
+
+
+def test_get_gemini_response_persists_only_validated_replies(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        monkeypatch.setattr(app, "LLM_CACHE_DB",
+                            os.path.join(tmpdir, "cache.db"))
+        model = _TextModel("Sorry, I cannot help with that.")
+        monkeypatch.setattr(app, "_get_model", lambda name, system_instruction=None: model)
+        question, prompt = "unvalidated reply?", ["validated-prompt"]
+        key = app._sql_response_key(question, prompt)
+
+        assert app.get_gemini_response(question, prompt) == model.text
+        assert app._llm_cache_get(key) is None
+
+        app.forget_sql_response(question, prompt)
+        model.text = "```SELECT id FROM fintech```"
+        assert app.get_gemini_response(question, prompt) == model.text
+        assert model.calls == 2
+
+        app.remember_sql_response(question, prompt, model.text)
+        assert app._llm_cache_get(key) == model.text
+
+
+def test_llm_cache_put_prunes_expired_rows(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        monkeypatch.setattr(app, "LLM_CACHE_DB",
+                            os.path.join(tmpdir, "cache.db"))
+        app._llm_cache_put(app._llm_cache_key("old"), "stale")
+
+        now = app.time.time()
+        monkeypatch.setattr(app.time, "time",
+                            lambda: now + app._LLM_CACHE_TTL + 1)
+        app._llm_cache_put(app._llm_cache_key("new"), "fresh")
+
+        conn, _ = app._llm_cache_connect(app.LLM_CACHE_DB)
+        assert conn.execute("SELECT response FROM llm_cache").fetchall() == [("fresh",)]
+
+
+def test_unknown_log_level_falls_back_to_warning():
+    env = dict(os.environ, LOG_LEVEL="verbose")
+    result = subprocess.run(
+        [sys.executable, "-c", "import app, logging; print(logging.getLogger().level)"],
+        cwd=os.path.dirname(app.__file__), env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split()[-1] == str(app.logging.WARNING)
@@ -0,0 +1,407 @@
+import gc
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import weakref
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import support_agent  # noqa: E402
+
+
+def test_init_database_creates_stats_indexes():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "tickets.db")
+        support_agent.SupportTicketDatabase(db_path)
+
+        conn = sqlite3.connect(db_path)
+        indexes = {row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")}
+        conn.close()
+        assert {"idx_tickets_status_cat", "idx_tickets_category",
+            "idx_tickets_email"} <= indexes
+
+
+def test_init_database_runs_optimize():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = support_agent.SupportTicketDatabase(
+            os.path.join(tmpdir, "tickets.db"))
+        statements = []
+        db.conn.set_trace_callback(statements.append)
+        db.init_database()
+
+        assert "PRAGMA optimize" in statements
+        db.close()
+
+
+class _FakeEmbedder:
+    """Stands in for genai.embed_content with one axis per support topic"""
+
+    topics = ("card", "kyc", "account", "transfer")
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, model, content, task_type):
+        self.calls.append(list(content))
+        return {"embedding": [[1.0 if topic in text.lower() else 0.0 for topic in self.topics] + [0.1]
+                              for text in content]}
+
+
+class _FakeGemini:
+    def __init__(self, text):
+        self.text = text
+        self.calls = 0
+        self.prompts = []
+
+    def generate_content(self, prompt):
+        self.calls += 1
+        self.prompts.append(prompt)
+        return type("Response", (), {"text": self.text})()
+
+
+def _classifier(monkeypatch):
+    embedder = _FakeEmbedder()
+    monkeypatch.setattr(support_agent.genai, "embed_content", embedder)
+    return support_agent.VectorRAGClassifier(), embedder
+
+
+def test_classify_query_memoizes_normalized_queries(monkeypatch):
+    classifier, embedder = _classifier(monkeypatch)
+    embedder.calls.clear()
+
+    category, similarity = classifier.classify_query("My card is blocked")
+    assert category == "debit_card" and similarity > 0.9
+    assert classifier.classify_query(
+        "  my card is BLOCKED ") == (category, similarity)
+    assert embedder.calls == [["my card is blocked"]]
+
+
+def _agent(monkeypatch, gemini_text, classifier=None, db=None):
+    monkeypatch.setattr(support_agent, "VectorRAGClassifier", lambda: classifier)
+    monkeypatch.setattr(support_agent, "SupportTicketDatabase", lambda: db)
+    monkeypatch.setattr(support_agent.genai, "GenerativeModel",
+                        lambda name: _FakeGemini(gemini_text))
+    return support_agent.SupportAgent()
+
+
+def test_classify_query_falls_back_when_embedding_fails(monkeypatch):
+    def unavailable(model, content, task_type):
+        raise RuntimeError("429 Resource exhausted")
+
+    monkeypatch.setattr(support_agent.genai, "embed_content", unavailable)
+    classifier = support_agent.VectorRAGClassifier()
+    assert classifier.classify_query("my account is frozen") is None
+    assert classifier.classify_query("card blocked") == ("debit_card", 1.0)
+
+    embedder = _FakeEmbedder()
+    monkeypatch.setattr(support_agent.genai, "embed_content", embedder)
+    category, similarity = classifier.classify_query("my account is frozen")
+    assert category == "bank_account" and similarity > 0.9
+    assert len(embedder.calls) == 2
+
+
+def test_analyze_query_memoizes_and_does_not_cache_failures(monkeypatch):
+    agent = _agent(monkeypatch, "not json")
+    assert agent.analyze_query("kyc failed") == ("general", 0.0)
+
+    agent.gemini.text = '```json\n{"category": "kyc", "confidence": 0.9}\n```'
+    assert agent.analyze_query("KYC failed") == ("kyc", 0.9)
+    assert agent.analyze_query("kyc failed") == ("kyc", 0.9)
+    assert agent.gemini.calls == 2
+
+
+def test_analyze_query_sends_original_text(monkeypatch):
+    agent = _agent(monkeypatch, '{"category": "cross_border", "confidence": 0.8}')
+    agent.analyze_query("  Where is my SWIFT payment REF-42AB? ")
+    assert agent.analyze_query("where is my swift payment ref-42ab?") == ("cross_border", 0.8)
+
+    assert agent.gemini.calls == 1
+    assert 'Query: "  Where is my SWIFT payment REF-42AB? "' in agent.gemini.prompts[0]
+
+
+def test_analyze_query_cache_expires(monkeypatch):
+    agent = _agent(monkeypatch, '{"category": "kyc", "confidence": 0.9}')
+    assert agent.analyze_query("kyc failed") == ("kyc", 0.9)
+
+    now = time.monotonic()
+    monkeypatch.setattr(support_agent.time, "monotonic",
+                        lambda: now + support_agent.ANALYSIS_CACHE_TTL + 1)
+    assert agent.analyze_query("kyc failed") == ("kyc", 0.9)
+    assert agent.gemini.calls == 2
+
+
+def test_classify_cache_is_per_instance(monkeypatch):
+    first, embedder = _classifier(monkeypatch)
+    second = support_agent.VectorRAGClassifier()
+    embedder.calls.clear()
+
+    first.classify_query("my account is frozen")
+    second.classify_query("my account is frozen")
+    assert len(embedder.calls) == 2
+
+    ref = weakref.ref(first)
+    del first
+    gc.collect()
+    assert ref() is None
+
+
+class _FixedClassifier:
+    def __init__(self, category, similarity):
+        self.result = (category, similarity)
+
+    def classify_query(self, query):
+        return self.result
+
+
+def test_process_query_skips_gemini_outside_ambiguous_band(monkeypatch):
+    agent = _agent(monkeypatch, "{}", _FixedClassifier("kyc", 0.1))
+    result = agent.process_query("what time is it", "user@example.com")
+    assert not result["routed_to_support"] and result["category"] == "general"
+    assert agent.gemini.calls == 0
+
+
+def test_process_query_follows_gemini_in_ambiguous_band(monkeypatch):
+    agent = _agent(monkeypatch, '{"category": "general", "confidence": 0.95}',
+                   _FixedClassifier("kyc", 0.5))
+    result = agent.process_query("is my profile ok", "user@example.com")
+    assert not result["routed_to_support"] and result["category"] == "general"
+    assert result["ticket_number"] is None
+    assert agent.gemini.calls == 1
+
+
+def _ticketing_agent(monkeypatch, tmpdir, gemini_text, classifier):
+    db = support_agent.SupportTicketDatabase(os.path.join(tmpdir, "tickets.db"))
+    agent = _agent(monkeypatch, gemini_text, classifier, db)
+    agent.emailer = type("Emailer", (), {"send_both": lambda self, t: (True, True)})()
+    return agent
+
+
+def test_process_query_routes_on_gemini_category_in_ambiguous_band(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        agent = _ticketing_agent(monkeypatch, tmpdir, '{"category": "cross_border", "confidence": 0.8}',
+                                 _FixedClassifier("kyc", 0.5))
+        result = agent.process_query("money to my sister abroad", "user@example.com")
+        agent._email_pool.shutdown(wait=True)
+
+        assert result["routed_to_support"] and result["category"] == "cross_border"
+        agent.db.close()
+
+
+def test_process_query_uses_vector_backup_when_gemini_fails(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        agent = _ticketing_agent(monkeypatch, tmpdir, "not json",
+                                 _FixedClassifier("kyc", 0.7))
+        result = agent.process_query("verify my identity", "user@example.com")
+        agent._email_pool.shutdown(wait=True)
+        assert result["routed_to_support"] and result["category"] == "kyc"
+
+        agent.classifier = _FixedClassifier("kyc", 0.5)
+        result = agent.process_query("is my profile ok", "user@example.com")
+        assert not result["routed_to_support"] and result["category"] == "general"
+        agent.db.close()
+
+
+def test_ticket_database_reuses_one_connection():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = support_agent.SupportTicketDatabase(
+            os.path.join(tmpdir, "tickets.db"))
+        conn = db.conn
+        ticket_number = db.create_ticket(
+            "user@example.com", "card blocked", "debit_card", "medium")["ticket_number"]
+        db.update_ticket_status(ticket_number, "closed")
+        db.mark_email_sent(ticket_number)
+
+        assert db.conn is conn
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert tuple(conn.execute(
+            "SELECT status, email_sent FROM support_tickets WHERE ticket_number = ?",
+            (ticket_number,)).fetchone()) == ("closed", 1)
+        db.close()
+
+
+def test_create_ticket_returns_ticket_details():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = support_agent.SupportTicketDatabase(
+            os.path.join(tmpdir, "tickets.db"))
+        ticket = db.create_ticket(
+            "user@example.com", "kyc failed", "kyc", "high")
+
+        assert ticket["ticket_number"].startswith("TKT-")
+        assert set(ticket) == {"ticket_number", "user_email", "user_query",
+                               "category", "priority", "created_at"}
+        assert (ticket["user_email"], ticket["user_query"], ticket["category"], ticket["priority"]) == (
+            "user@example.com", "kyc failed", "kyc", "high")
+        assert ticket["created_at"] == db.conn.execute(
+            "SELECT created_at FROM support_tickets WHERE ticket_number = ?",
+            (ticket["ticket_number"],)).fetchone()[0]
+        db.close()
+
+
+class _FakeSMTP:
+    instances = []
+
+    def __init__(self, host, port):
+        self.sent = []
+        self.bodies = []
+        _FakeSMTP.instances.append(self)
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def noop(self):
+        return (250, b"OK")
+
+    def send_message(self, msg):
+        self.sent.append(msg["To"])
+        self.bodies.append(msg.get_content())
+
+    def quit(self):
+        pass
+
+
+def test_send_both_reuses_one_smtp_session(monkeypatch):
+    monkeypatch.setattr(support_agent.smtplib, "SMTP", _FakeSMTP)
+    monkeypatch.setenv("SUPPORT_EMAIL", "support@example.com")
+    monkeypatch.setenv("SUPPORT_TEAM_EMAIL", "team@example.com")
+    _FakeSMTP.instances = []
+
+    notifier = support_agent.SupportEmailNotifier()
+    ticket = {"ticket_number": "TKT-1", "user_email": "user@example.com", "user_query": "card blocked",
+              "category": "debit_card", "priority": "medium", "created_at": "2024-06-01 10:00:00"}
+
+    assert notifier.send_both(ticket) == (True, True)
+    assert len(_FakeSMTP.instances) == 1
+    assert _FakeSMTP.instances[0].sent == [
+        "team@example.com", "user@example.com"]
+    assert "Ticket Number: TKT-1" in _FakeSMTP.instances[0].bodies[1]
+    notifier.close()
+
+
+def test_process_query_dispatches_emails_in_background(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        classifier, _ = _classifier(monkeypatch)
+        db = support_agent.SupportTicketDatabase(
+            os.path.join(tmpdir, "tickets.db"))
+        agent = _agent(monkeypatch, '{"category": "debit_card", "confidence": 0.9}',
+                       classifier, db)
+        agent.emailer = type("Emailer", (), {"send_both": lambda self, t: (True, True)})()
+        agent._email_pool = support_agent.ThreadPoolExecutor(max_workers=1)
+
+        result = agent.process_query("debit card declined", "user@example.com")
+        agent._email_pool.shutdown(wait=True)
+
+        assert result["routed_to_support"]
+        assert agent.db.conn.execute(
+            "SELECT email_sent FROM support_tickets WHERE ticket_number = ?",
+            (result["ticket_number"],)).fetchone()[0] == 1
+        agent.db.close()
+
+
+def test_process_query_asks_gemini_when_embeddings_fail(monkeypatch):
+    def unavailable(model, content, task_type):
+        raise RuntimeError("404 embedding model not found")
+
+    monkeypatch.setattr(support_agent.genai, "embed_content", unavailable)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = support_agent.SupportTicketDatabase(
+            os.path.join(tmpdir, "tickets.db"))
+        agent = _agent(monkeypatch, '{"category": "kyc", "confidence": 0.9}',
+                       support_agent.VectorRAGClassifier(), db)
+        agent._email_pool = support_agent.ThreadPoolExecutor(max_workers=1)
+        agent.emailer = type("Emailer", (), {"send_both": lambda self, t: (True, True)})()
+
+        result = agent.process_query("my documents were rejected", "user@example.com")
+        agent._email_pool.shutdown(wait=True)
+
+        assert agent.gemini.calls == 1
+        assert result["routed_to_support"] and result["category"] == "kyc"
+        assert db.conn.execute(
+            "SELECT category FROM support_tickets WHERE ticket_number = ?",
+            (result["ticket_number"],)).fetchone()[0] == "kyc"
+        db.close()
+
+
+def test_init_vectors_embeds_keywords_in_one_batch(monkeypatch):
+    classifier, embedder = _classifier(monkeypatch)
+
+    keyword_count = sum(len(keywords)
+                        for keywords in support_agent.SUPPORT_CATEGORIES.values())
+    assert len(embedder.calls) == 1 and len(embedder.calls[0]) == keyword_count
+    assert classifier.kw_mat_i8.shape[0] == len(classifier.kw_cats) == keyword_count
+
+
+def test_quantized_similarity_matches_float_cosine():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(26, 768)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query = vectors[3] + 0.1 * vectors[7]
+    query /= np.linalg.norm(query)
+
+    mat_i8, mat_scale = support_agent.VectorRAGClassifier._quantize(vectors)
+    q_i8, q_scale = support_agent.VectorRAGClassifier._quantize(query[None, :])
+    sims = (mat_i8.astype(np.int32) @ q_i8[0].astype(np.int32)) / (mat_scale * q_scale[0])
+
+    assert mat_i8.dtype == np.int8
+    assert np.allclose(sims, vectors @ query, atol=0.02)
+
+
+def test_analyze_query_parses_bare_and_fenced_json(monkeypatch):
+    agent = _agent(
+        monkeypatch, 'Sure:\n```json\n{"category": "cross_border", "confidence": 0.6}\n```')
+    assert agent.analyze_query("wire to london") == ("cross_border", 0.6)
+
+    agent.gemini.text = '{"category": "kyc", "confidence": 0.8}'
+    assert agent.analyze_query("kyc pending") == ("kyc", 0.8)
+
+
+def test_classify_query_keyword_hit_skips_embedding(monkeypatch):
+    classifier, embedder = _classifier(monkeypatch)
+    embedder.calls.clear()
+
+    assert classifier.classify_query(
+        "What is my KYC status?") == ("kyc", 1.0)
+    assert classifier.classify_query(
+        "Can I send a SWIFT transfer") == ("cross_border", 1.0)
+    assert embedder.calls == []
+
+
+def test_get_support_agent_builds_one_instance_under_concurrency(monkeypatch):
+    built = []
+
+    def slow_agent():
+        time.sleep(0.05)
+        built.append(object())
+        return built[-1]
+
+    monkeypatch.setattr(support_agent, "SupportAgent", slow_agent)
+    monkeypatch.setattr(support_agent, "_support_agent", None)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        support_agent.get_support_agent())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(built) == 1
+    assert all(result is built[0] for result in results)
+
+
+def test_create_ticket_numbers_are_unique_within_a_burst():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = support_agent.SupportTicketDatabase(
+            os.path.join(tmpdir, "tickets.db"))
+        numbers = {db.create_ticket("user@example.com", "card blocked", "debit_card")["ticket_number"]
+                   for _ in range(20)}
+        assert len(numbers) == 20
+        db.close()